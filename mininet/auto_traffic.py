@@ -6,12 +6,16 @@ from mininet.log import setLogLevel
 import time
 import random
 import os
+import csv
 import threading
 import subprocess
 import signal
 from datetime import datetime
 import sflow
 
+# Thư mục dữ liệu dùng chung với Ryu (monitor_stat.py) và web
+CSV_DIR = "SDN/web/data"
+
 class MultiSwitchTopo(Topo):
     def build(self):
         # Tầng core: 1 switch trung tâm
@@ -40,7 +44,12 @@ class MultiSwitchTopo(Topo):
                     host_id += 1
 
 def configure_links(net):
-    """Cấu hình tất cả các link với tc và quantum cố định."""
+    """Cấu hình tất cả các link với tc và quantum cố định.
+
+    Băng thông đã shape của từng port switch được ghi vào link_capacity.csv để bộ điều khiển QoS
+    tính mức sử dụng theo dung lượng thật của link.
+    """
+    capacity_rows = []
     for link in net.links:
         intf1 = link.intf1
         intf2 = link.intf2
@@ -73,6 +82,14 @@ def configure_links(net):
             intf.node.cmd(f'tc qdisc add dev {intf_name} root handle 1: htb default 10')
             intf.node.cmd(f'tc class add dev {intf_name} parent 1: classid 1:10 htb rate {bw}mbit quantum {quantum}')
             intf.node.cmd(f'tc qdisc add dev {intf_name} parent 1:10 netem delay {delay} jitter {jitter} loss {loss}%')
+            if intf.node in net.switches:
+                capacity_rows.append([int(intf.node.dpid, 16), intf.node.ports[intf], intf_name, round(bw, 2)])
+
+    os.makedirs(CSV_DIR, exist_ok=True)
+    with open(os.path.join(CSV_DIR, "link_capacity.csv"), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["dpid", "port_no", "intf", "bw_mbps"])
+        writer.writerows(capacity_rows)
 
 def run_traffic(net, iteration, duration=600):
     hosts = net.hosts
@@ -213,6 +230,29 @@ def analyze_logs():
     avg_throughput = sum(iperf_throughputs) / len(iperf_throughputs) if iperf_throughputs else 0
     avg_packet_loss = sum(packet_loss_rates) / len(packet_loss_rates) if packet_loss_rates else 0
     print(f"📊 Analysis: Average ping delay: {avg_delay:.2f} ms, Average throughput: {avg_throughput:.2f} Mbps, Average packet loss: {avg_packet_loss:.2f}%")
+    return avg_delay, avg_throughput, avg_packet_loss
+
+def summarize_qos(since, throughput, packet_loss, csv_dir=CSV_DIR):
+    """Tổng hợp các quyết định QoS (qos_events_*.csv do Ryu ghi) từ thời điểm `since`,
+    đặt cạnh throughput và tỉ lệ mất gói của cùng iteration."""
+    installs = removals = 0
+    utils = []
+    if os.path.isdir(csv_dir):
+        for filename in os.listdir(csv_dir):
+            if not (filename.startswith("qos_events_") and filename.endswith(".csv")):
+                continue
+            with open(os.path.join(csv_dir, filename), newline='') as f:
+                for row in csv.DictReader(f):
+                    if float(row["timestamp"]) < since:
+                        continue
+                    if row["action"] == "install":
+                        installs += 1
+                        utils.append(float(row["utilization"]))
+                    elif row["action"] == "remove":
+                        removals += 1
+    avg_util = sum(utils) / len(utils) if utils else 0
+    print(f"🚦 QoS: {installs} meters installed, {removals} removed, average utilization at install: {avg_util:.2f} "
+          f"| throughput: {throughput:.2f} Mbps, packet loss: {packet_loss:.2f}%")
 
 if __name__ == '__main__':
     import math
@@ -230,8 +270,10 @@ if __name__ == '__main__':
     num_iterations = 3
     for iteration in range(1, num_iterations + 1):
         print(f"🚀 Starting iteration {iteration}/{num_iterations}")
+        iteration_start = time.time()
         run_traffic(net, iteration=iteration, duration=600)
-        analyze_logs()
+        _, avg_throughput, avg_packet_loss = analyze_logs()
+        summarize_qos(iteration_start, avg_throughput, avg_packet_loss)
         print(f"✅ Completed iteration {iteration}/{num_iterations}\n")
 
     net.stop()
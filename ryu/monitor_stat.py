@@ -1,6 +1,7 @@
 import csv
 import os
 import time
+from collections import defaultdict
 from operator import attrgetter
 
 from ryu.app import simple_switch_13
@@ -9,6 +10,15 @@ from ryu.controller.handler import MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.lib import hub
 
+# Tham số bộ điều khiển QoS vòng kín (dựa trên port stats)
+QOS_DEFAULT_LINK_MBPS = 100  # Dùng khi port không có trong link_capacity.csv
+QOS_HIGH_UTIL = 0.8        # Vượt ngưỡng này thì giới hạn các luồng lớn
+QOS_LOW_UTIL = 0.5         # Dưới ngưỡng này đủ QOS_CLEAR_CYCLES chu kỳ thì gỡ meter
+QOS_CLEAR_CYCLES = 3
+QOS_HEAVY_SHARE = 0.2      # Luồng chiếm >= 20% dung lượng link được coi là luồng lớn
+QOS_PRIORITY = 10          # Cao hơn flow của simple_switch_13 (priority 1)
+QOS_COOKIE = 0x51          # Đánh dấu flow do bộ điều khiển QoS cài để xóa được theo cookie
+
 
 class SimpleMonitorCSV(simple_switch_13.SimpleSwitch13):
 
@@ -21,6 +31,19 @@ class SimpleMonitorCSV(simple_switch_13.SimpleSwitch13):
         self.csv_dir = "SDN/web/data"
         os.makedirs(self.csv_dir, exist_ok=True)
 
+        # Trạng thái bộ điều khiển QoS; QOS_ENABLED=0 để chạy đối chứng không có QoS
+        self.qos_enabled = os.environ.get("QOS_ENABLED", "1") != "0"
+        self.port_prev = {}                      # (dpid, port_no) -> (timestamp, tx_bytes)
+        self.flow_prev = {}                      # (dpid, in_port, eth_src, eth_dst) -> (timestamp, byte_count)
+        self.flow_rates = defaultdict(dict)      # dpid -> {(in_port, eth_src, eth_dst): (out_port, bps)}
+        self.congested = {}                      # (dpid, port_no) -> số chu kỳ liên tiếp dưới QOS_LOW_UTIL
+        self.qos_meters = {}                     # (dpid, in_port, eth_src, eth_dst) -> (meter_id, out_port)
+        self.next_meter_id = defaultdict(lambda: 1)
+        # Băng thông đã shape của từng port, do configure_links (auto_traffic.py) ghi ra
+        self.capacity_file = os.path.join(self.csv_dir, "link_capacity.csv")
+        self.capacity_mtime = None
+        self.port_capacity = {}                  # (dpid, port_no) -> bps
+
     def _write_csv(self, filepath, header, rows):
         write_header = not os.path.exists(filepath)
         with open(filepath, 'a', newline='') as f:
@@ -38,10 +61,14 @@ class SimpleMonitorCSV(simple_switch_13.SimpleSwitch13):
             if datapath.id not in self.datapaths:
                 self.logger.debug('Register datapath: %016x', datapath.id)
                 self.datapaths[datapath.id] = datapath
+                # OVS ở fail-mode secure giữ lại flow/meter cũ qua lần kết nối lại
+                self._clear_qos_rules(datapath)
+                self._forget_qos_state(datapath.id)
         elif ev.state == DEAD_DISPATCHER:
             if datapath.id in self.datapaths:
                 self.logger.debug('Unregister datapath: %016x', datapath.id)
                 del self.datapaths[datapath.id]
+                self._forget_qos_state(datapath.id)
 
     def _monitor(self):
         while True:
@@ -60,7 +87,7 @@ class SimpleMonitorCSV(simple_switch_13.SimpleSwitch13):
         datapath.send_msg(parser.OFPDescStatsRequest(datapath))
         datapath.send_msg(parser.OFPGroupStatsRequest(datapath))
         datapath.send_msg(parser.OFPQueueStatsRequest(datapath, 0, ofproto.OFPP_ANY, ofproto.OFPQ_ALL))
-        datapath.send_msg(parser.OFPMeterStatsRequest(datapath, 0xffff))
+        datapath.send_msg(parser.OFPMeterStatsRequest(datapath, 0, ofproto.OFPM_ALL))
 
     @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
     def _flow_stats_reply_handler(self, ev):
@@ -74,9 +101,13 @@ class SimpleMonitorCSV(simple_switch_13.SimpleSwitch13):
             match = stat.match
             in_port = match.get('in_port', '-')
             eth_dst = match.get('eth_dst', '-')
-            out_port = stat.instructions[0].actions[0].port if stat.instructions else '-'
+            # Flow có meter mang OFPInstructionMeter trước instruction chứa actions
+            actions = [inst.actions for inst in stat.instructions if hasattr(inst, 'actions') and inst.actions]
+            out_port = actions[0][0].port if actions else '-'
             rows.append([timestamp, dpid, in_port, eth_dst, out_port,
                          stat.packet_count, stat.byte_count, stat.duration_sec])
+            if stat.priority in (1, QOS_PRIORITY) and out_port != '-':
+                self._update_flow_rate(dpid, timestamp, match, stat.priority, out_port, stat.byte_count)
 
         self._write_csv(os.path.join(self.csv_dir, f"flow_stats_{dpid}.csv"), header, rows)
 
@@ -94,6 +125,7 @@ class SimpleMonitorCSV(simple_switch_13.SimpleSwitch13):
                          stat.tx_packets, stat.tx_bytes, stat.tx_errors])
 
         self._write_csv(os.path.join(self.csv_dir, f"port_stats_{dpid}.csv"), header, rows)
+        self._update_qos(ev.msg.datapath, timestamp, body)
 
     @set_ev_cls(ofp_event.EventOFPTableStatsReply, MAIN_DISPATCHER)
     def _table_stats_reply_handler(self, ev):
@@ -163,3 +195,158 @@ class SimpleMonitorCSV(simple_switch_13.SimpleSwitch13):
                          stat.byte_in_count, stat.duration_sec])
 
         self._write_csv(os.path.join(self.csv_dir, f"meter_stats_{dpid}.csv"), header, rows)
+
+    def _update_flow_rate(self, dpid, timestamp, match, priority, out_port, byte_count):
+        key = (match.get('in_port'), match.get('eth_src'), match.get('eth_dst'))
+        # Khi đã có meter, flow priority 1 bị che và bộ đếm đứng yên: chỉ lấy mẫu từ flow có meter
+        metered = (dpid,) + key in self.qos_meters
+        if priority != (QOS_PRIORITY if metered else 1):
+            return
+        prev = self.flow_prev.get((dpid,) + key)
+        self.flow_prev[(dpid,) + key] = (timestamp, byte_count)
+        if prev is not None and timestamp > prev[0]:
+            bps = max(0, byte_count - prev[1]) * 8 / (timestamp - prev[0])
+            self.flow_rates[dpid][key] = (out_port, bps)
+
+    def _update_qos(self, datapath, timestamp, body):
+        """Đo mức sử dụng chiều tx của từng port; giới hạn luồng lớn khi nghẽn, gỡ có trễ (hysteresis)."""
+        if not self.qos_enabled:
+            return
+        dpid = datapath.id
+        self._load_port_capacity()
+        for stat in body:
+            if stat.port_no > datapath.ofproto.OFPP_MAX:
+                continue
+            key = (dpid, stat.port_no)
+            capacity = self._capacity(dpid, stat.port_no)
+            prev = self.port_prev.get(key)
+            self.port_prev[key] = (timestamp, stat.tx_bytes)
+            if prev is None or timestamp <= prev[0]:
+                continue
+            util = max(0, stat.tx_bytes - prev[1]) * 8 / (timestamp - prev[0]) / capacity
+
+            if util >= QOS_HIGH_UTIL:
+                self.congested[key] = 0
+                self._limit_heavy_flows(datapath, timestamp, stat.port_no, util)
+            elif key in self.congested:
+                if util < QOS_LOW_UTIL:
+                    self.congested[key] += 1
+                    if self.congested[key] >= QOS_CLEAR_CYCLES:
+                        del self.congested[key]
+                        self._release_port_meters(datapath, timestamp, stat.port_no, util)
+                else:
+                    self.congested[key] = 0
+
+    def _limit_heavy_flows(self, datapath, timestamp, port_no, util):
+        dpid = datapath.id
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        capacity = self._capacity(dpid, port_no)
+
+        heavy = [flow for flow, (out_port, bps) in self.flow_rates[dpid].items()
+                 if out_port == port_no and bps >= QOS_HEAVY_SHARE * capacity
+                 and (dpid,) + flow not in self.qos_meters]
+        if not heavy:
+            return
+        # Chia đều phần dung lượng dưới ngưỡng cao cho mọi luồng bị giới hạn trên port (cũ và mới)
+        metered = [key for key, (_, out_port) in self.qos_meters.items()
+                   if key[0] == dpid and out_port == port_no]
+        rate_kbps = int(capacity * QOS_HIGH_UTIL / (len(metered) + len(heavy)) / 1000)
+        bands = [parser.OFPMeterBandDrop(rate=rate_kbps, burst_size=0)]
+
+        for key in metered:
+            meter_id = self.qos_meters[key][0]
+            datapath.send_msg(parser.OFPMeterMod(datapath, command=ofproto.OFPMC_MODIFY,
+                                                 flags=ofproto.OFPMF_KBPS, meter_id=meter_id, bands=bands))
+            _, in_port, eth_src, eth_dst = key
+            self._record_qos(dpid, timestamp, port_no, "modify", in_port, eth_src, eth_dst,
+                             meter_id, rate_kbps, util)
+
+        for in_port, eth_src, eth_dst in heavy:
+            meter_id = self.next_meter_id[dpid]
+            self.next_meter_id[dpid] += 1
+            datapath.send_msg(parser.OFPMeterMod(datapath, command=ofproto.OFPMC_ADD,
+                                                 flags=ofproto.OFPMF_KBPS, meter_id=meter_id, bands=bands))
+
+            match = parser.OFPMatch(in_port=in_port, eth_src=eth_src, eth_dst=eth_dst)
+            inst = [parser.OFPInstructionMeter(meter_id),
+                    parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
+                                                 [parser.OFPActionOutput(port_no)])]
+            datapath.send_msg(parser.OFPFlowMod(datapath=datapath, cookie=QOS_COOKIE, priority=QOS_PRIORITY,
+                                                match=match, instructions=inst))
+
+            self.qos_meters[(dpid, in_port, eth_src, eth_dst)] = (meter_id, port_no)
+            self._reset_flow_rate(dpid, (in_port, eth_src, eth_dst))
+            self._record_qos(dpid, timestamp, port_no, "install", in_port, eth_src, eth_dst,
+                             meter_id, rate_kbps, util)
+
+    def _release_port_meters(self, datapath, timestamp, port_no, util):
+        dpid = datapath.id
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        for key, (meter_id, out_port) in list(self.qos_meters.items()):
+            if key[0] != dpid or out_port != port_no:
+                continue
+            _, in_port, eth_src, eth_dst = key
+            match = parser.OFPMatch(in_port=in_port, eth_src=eth_src, eth_dst=eth_dst)
+            datapath.send_msg(parser.OFPFlowMod(datapath=datapath, command=ofproto.OFPFC_DELETE_STRICT,
+                                                priority=QOS_PRIORITY, match=match,
+                                                out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY))
+            datapath.send_msg(parser.OFPMeterMod(datapath, command=ofproto.OFPMC_DELETE,
+                                                 flags=0, meter_id=meter_id))
+
+            del self.qos_meters[key]
+            self._reset_flow_rate(dpid, (in_port, eth_src, eth_dst))
+            self._record_qos(dpid, timestamp, port_no, "remove", in_port, eth_src, eth_dst,
+                             meter_id, 0, util)
+
+    def _clear_qos_rules(self, datapath):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        datapath.send_msg(parser.OFPFlowMod(datapath=datapath, command=ofproto.OFPFC_DELETE,
+                                            cookie=QOS_COOKIE, cookie_mask=0xffffffffffffffff,
+                                            table_id=ofproto.OFPTT_ALL, match=parser.OFPMatch(),
+                                            out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY))
+        datapath.send_msg(parser.OFPMeterMod(datapath, command=ofproto.OFPMC_DELETE,
+                                             flags=0, meter_id=ofproto.OFPM_ALL))
+
+    def _reset_flow_rate(self, dpid, flow):
+        # Flow đổi sang bộ đếm khác (có/không meter): bỏ mẫu cũ để không dùng tốc độ đã lỗi thời
+        self.flow_prev.pop((dpid,) + flow, None)
+        self.flow_rates[dpid].pop(flow, None)
+
+    def _load_port_capacity(self):
+        try:
+            mtime = os.stat(self.capacity_file).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self.capacity_mtime:
+            return
+        capacity = {}
+        with open(self.capacity_file, newline='') as f:
+            for row in csv.DictReader(f):
+                capacity[(int(row["dpid"]), int(row["port_no"]))] = float(row["bw_mbps"]) * 1_000_000
+        self.port_capacity = capacity
+        self.capacity_mtime = mtime
+
+    def _capacity(self, dpid, port_no):
+        return self.port_capacity.get((dpid, port_no), QOS_DEFAULT_LINK_MBPS * 1_000_000)
+
+    def _record_qos(self, dpid, timestamp, port_no, action, in_port, eth_src, eth_dst,
+                    meter_id, rate_kbps, util):
+        self.logger.info('QoS %s: dpid=%s port=%s %s->%s meter=%s rate=%skbps util=%.2f',
+                         action, dpid, port_no, eth_src, eth_dst, meter_id, rate_kbps, util)
+        header = ["timestamp", "dpid", "port_no", "action", "in_port", "eth_src", "eth_dst",
+                  "meter_id", "rate_kbps", "utilization"]
+        row = [timestamp, dpid, port_no, action, in_port, eth_src, eth_dst,
+               meter_id, rate_kbps, round(util, 4)]
+        self._write_csv(os.path.join(self.csv_dir, f"qos_events_{dpid}.csv"), header, [row])
+
+    def _forget_qos_state(self, dpid):
+        # Chỉ xóa trạng thái phía controller; rule trên switch được dọn bởi _clear_qos_rules khi kết nối lại
+        for state in (self.port_prev, self.flow_prev, self.congested, self.qos_meters):
+            for key in [k for k in state if k[0] == dpid]:
+                del state[key]
+        self.flow_rates.pop(dpid, None)
+        self.next_meter_id.pop(dpid, None)
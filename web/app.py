@@ -1,8 +1,14 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, request
 import csv
+import gzip
+import hashlib
+import json
 import os
-from collections import defaultdict
+import threading
+from collections import defaultdict, OrderedDict
 import logging
+import time
+import numpy as np
 import requests
 from datetime import datetime
 
@@ -16,6 +22,37 @@ logger = logging.getLogger(__name__)
 
 # Lưu trữ dữ liệu sFlow theo thời gian (danh sách tạm thời, có thể thay bằng file hoặc cơ sở dữ liệu)
 sflow_data_store = defaultdict(list)
+# Số thứ tự tăng mỗi lần thực sự poll sFlow-RT, dùng làm phiên bản cho ETag
+sflow_store_seq = 0
+# Poll sFlow-RT tối đa một lần mỗi SFLOW_POLL_INTERVAL giây, dù có bao nhiêu tab đang mở
+SFLOW_POLL_INTERVAL = 10
+sflow_last_poll = 0.0
+sflow_poll_lock = threading.Lock()
+# Số điểm sFlow giữ lại (1 ngày với chu kỳ 10 s)
+SFLOW_HISTORY = 8640
+SFLOW_METRICS = {
+    "ifinoctets": "Bytes In (Mbps)",
+    "ifoutoctets": "Bytes Out (Mbps)",
+    "ifindiscards": "Input Discards",
+    "ifoutdiscards": "Output Discards"
+}
+
+# Mặc định trả về 20 mốc gần nhất; khi có ?start=&end=&points= thì lấy mẫu lại theo LTTB
+DEFAULT_BUCKETS = 20
+DEFAULT_POINTS = 1000
+MAX_POINTS = 5000
+
+# Cache các response đã tính theo ETag để nhiều tab dùng chung
+RESPONSE_CACHE_SIZE = 64
+GZIP_MIN_BYTES = 512
+response_cache = OrderedDict()
+response_cache_lock = threading.Lock()
+
+ID_COLUMNS = ["port_no", "in_port", "out_port", "table_id", "queue_id", "meter_id"]
+KEY_COLUMNS = ["port_no", "in_port", "table_id", "queue_id", "meter_id"]
+# Mảng cột (chuỗi và float) đã đọc của từng file stats, làm mới khi file thay đổi
+column_cache = {}
+column_cache_lock = threading.Lock()
 
 @app.route("/")
 def index():
@@ -25,179 +62,421 @@ def index():
 @app.route("/api/port_stats")
 def port_stats():
     dpid = request.args.get("dpid", "1")
+    window = range_args()
+    aggregate = request.args.get("aggregate") == "sum"
     filepath = os.path.join(CSV_DIR, f"port_stats_{dpid}.csv")
-    return jsonify(read_csv(filepath, ["timestamp", "port_no", "tx_packets", "tx_bytes", "rx_packets", "rx_bytes"]))
+    return versioned_response(file_version([filepath]), lambda: read_csv(filepath, ["timestamp", "port_no", "tx_packets", "tx_bytes", "rx_packets", "rx_bytes"], window, aggregate=aggregate))
 
 @app.route("/api/flow_stats")
 def flow_stats():
     dpid = request.args.get("dpid", "1")
+    window = range_args()
     filepath = os.path.join(CSV_DIR, f"flow_stats_{dpid}.csv")
-    return jsonify(read_csv(filepath, ["timestamp", "in_port", "packet_count", "byte_count"]))
+    return versioned_response(file_version([filepath]), lambda: read_csv(filepath, ["timestamp", "in_port", "packet_count", "byte_count"], window, cap_rows=True))
 
 @app.route("/api/table_stats")
 def table_stats():
     dpid = request.args.get("dpid", "1")
+    window = range_args()
     filepath = os.path.join(CSV_DIR, f"table_stats_{dpid}.csv")
-    return jsonify(read_csv(filepath, ["timestamp", "table_id", "active_count", "lookup_count", "matched_count"]))
+    return versioned_response(file_version([filepath]), lambda: read_csv(filepath, ["timestamp", "table_id", "active_count", "lookup_count", "matched_count"], window, cap_rows=True))
 
 @app.route("/api/queue_stats")
 def queue_stats():
     dpid = request.args.get("dpid", "1")
+    window = range_args()
     filepath = os.path.join(CSV_DIR, f"queue_stats_{dpid}.csv")
-    return jsonify(read_csv(filepath, ["timestamp", "port_no", "queue_id", "tx_bytes", "tx_packets", "tx_errors"]))
+    return versioned_response(file_version([filepath]), lambda: read_csv(filepath, ["timestamp", "port_no", "queue_id", "tx_bytes", "tx_packets", "tx_errors"], window))
 
 @app.route("/api/meter_stats")
 def meter_stats():
     dpid = request.args.get("dpid", "1")
+    window = range_args()
     filepath = os.path.join(CSV_DIR, f"meter_stats_{dpid}.csv")
-    return jsonify(read_csv(filepath, ["timestamp", "meter_id", "flow_count", "packet_in_count", "byte_in_count", "duration_sec"]))
+    return versioned_response(file_version([filepath]), lambda: read_csv(filepath, ["timestamp", "meter_id", "flow_count", "packet_in_count", "byte_in_count", "duration_sec"], window))
 
 @app.route("/api/all_bandwidth")
 def network_bandwidth():
     switch_ids = get_switch_ids()
-    timeline = defaultdict(float)
-    port_counts = defaultdict(set)
+    paths = [os.path.join(CSV_DIR, f"port_stats_{dpid}.csv") for dpid in switch_ids]
+    window = range_args()
+    return versioned_response(file_version(paths), lambda: compute_network_bandwidth(switch_ids, window))
+
+def compute_network_bandwidth(switch_ids, window=None):
+    buckets, normalized, ports = [], [], []
     for dpid in switch_ids:
         filepath = os.path.join(CSV_DIR, f"port_stats_{dpid}.csv")
         if not os.path.exists(filepath):
             logger.warning(f"File not found: {filepath}")
             continue
-        data = read_csv(filepath, ["timestamp", "port_no", "tx_bytes", "rx_bytes"])
-        for entry in data:
-            t = entry["timestamp"]
-            t_rounded = round(t / 10) * 10
-            tx = entry.get("tx_bytes", 0)
-            rx = entry.get("rx_bytes", 0)
-            delta_t = entry.get("delta_t", 10)
-            if delta_t > 0:
-                normalized_bytes = (tx + rx) * 10 / delta_t
-                timeline[t_rounded] += normalized_bytes
-            port_counts[t_rounded].add(f"{dpid}:{entry['port_no']}")
-    
-    total_ports = sum(len(set([f"{dpid}:{row['port_no']}" 
-                              for row in read_csv(os.path.join(CSV_DIR, f"port_stats_{dpid}.csv"), 
-                                                ["timestamp", "port_no"])])) 
-                      for dpid in switch_ids)
-    result = []
-    for t, b in sorted(timeline.items()):
-        if len(port_counts[t]) >= total_ports * 0.8:
-            mbps = round(b * 8 / 1_000_000, 2)
-            result.append({"timestamp": t, "mbps": mbps})
-    
-    return jsonify(result[-20:])
+        frame = counter_deltas(filepath, ["timestamp", "port_no", "tx_bytes", "rx_bytes"])
+        if not len(frame["timestamp"]):
+            continue
+        delta_t = frame["delta_t"]
+        # Chuẩn hóa byte về chu kỳ 10 s; mẫu có delta_t <= 0 không cộng băng thông nhưng vẫn tính port
+        safe_dt = np.where(delta_t > 0, delta_t, 1.0)
+        normalized.append(np.where(delta_t > 0, (frame["tx_bytes"] + frame["rx_bytes"]) * 10 / safe_dt, 0.0))
+        buckets.append(frame["timestamp"])
+        ports.append(np.char.add(f"{dpid}:", frame["port_no"]))
+    if not buckets:
+        return []
+
+    # Gộp mọi switch trong một lần reduce theo mốc thời gian
+    buckets = np.concatenate(buckets)
+    ports = np.concatenate(ports)
+    timeline, bucket_idx = np.unique(buckets, return_inverse=True)
+    total_bytes = np.bincount(bucket_idx, weights=np.concatenate(normalized), minlength=len(timeline))
+    port_ids, port_idx = np.unique(ports, return_inverse=True)
+    pairs = np.unique(bucket_idx * len(port_ids) + port_idx)
+    port_counts = np.bincount(pairs // len(port_ids), minlength=len(timeline))
+
+    complete = port_counts >= len(port_ids) * 0.8
+    timestamps = timeline[complete]
+    mbps = np.round(total_bytes[complete] * 8 / 1_000_000, 2)
+    keep = select_buckets(timestamps, mbps, window)
+    return [{"timestamp": int(t), "mbps": float(v)} for t, v in zip(timestamps[keep], mbps[keep])]
 
 @app.route("/api/drop_stats")
 def drop_stats():
-    timeline = defaultdict(int)
-    for dpid in get_switch_ids():
+    switch_ids = get_switch_ids()
+    paths = [os.path.join(CSV_DIR, f"flow_stats_{dpid}.csv") for dpid in switch_ids]
+    window = range_args()
+    return versioned_response(file_version(paths), lambda: compute_drop_stats(switch_ids, window))
+
+def compute_drop_stats(switch_ids, window=None):
+    buckets, counts = [], []
+    for dpid in switch_ids:
         filepath = os.path.join(CSV_DIR, f"flow_stats_{dpid}.csv")
         if not os.path.exists(filepath):
             continue
-        data = read_csv(filepath, ["timestamp", "in_port", "out_port", "packet_count"])
-        flow_drops = defaultdict(lambda: defaultdict(int))
-        for entry in data:
-            t = entry["timestamp"]
-            t_rounded = round(t / 10) * 10
-            in_port = entry.get("in_port", "0")
-            out_port = entry.get("out_port", "0")
-            packet_count = entry.get("packet_count", 0)
-            if in_port != "-":
-                flow_drops[t_rounded][(in_port, out_port)] += packet_count
-        for t_rounded, flows in flow_drops.items():
-            for (in_port, out_port), packet_count in flows.items():
-                timeline[t_rounded] += packet_count
-    result = [{"timestamp": t, "dropped": timeline[t]} for t in sorted(timeline)]
-    return jsonify(result[-20:])
+        frame = counter_deltas(filepath, ["timestamp", "in_port", "out_port", "packet_count"])
+        if "in_port" not in frame:
+            continue
+        matched = frame["in_port"] != "-"
+        buckets.append(frame["timestamp"][matched])
+        counts.append(frame["packet_count"][matched])
+    if not buckets:
+        return []
+
+    timeline, bucket_idx = np.unique(np.concatenate(buckets), return_inverse=True)
+    dropped = np.bincount(bucket_idx, weights=np.concatenate(counts), minlength=len(timeline))
+    keep = select_buckets(timeline, dropped, window)
+    return [{"timestamp": int(t), "dropped": float(v)} for t, v in zip(timeline[keep], dropped[keep])]
 
 @app.route("/api/sflow_metrics")
 def sflow_blackhole_metrics():
+    # Chỉ cập nhật store trước khi so ETag; kết quả chỉ được dựng khi client cần bản mới
+    poll_sflow_metrics()
+    window = range_args()
+    return versioned_response(f"sflow:{sflow_store_seq}", lambda: build_sflow_metrics(window))
+
+def poll_sflow_metrics():
+    global sflow_store_seq, sflow_last_poll
+    # Một request khác đang poll thì trả về dữ liệu hiện có thay vì chờ
+    if not sflow_poll_lock.acquire(blocking=False):
+        return
     try:
-        metrics = {
-            "ifinoctets": "Bytes In (Mbps)",
-            "ifoutoctets": "Bytes Out (Mbps)",
-            "ifindiscards": "Input Discards",
-            "ifoutdiscards": "Output Discards"
-        }
-        results = {}
-        for metric, label in metrics.items():
+        now = time.time()
+        if now - sflow_last_poll < SFLOW_POLL_INTERVAL:
+            return
+        sflow_last_poll = now
+        for metric in SFLOW_METRICS:
             url = f"http://127.0.0.1:8008/metric/ALL/{metric}/json"
             try:
                 resp = requests.get(url, timeout=5)
                 resp.raise_for_status()
                 values = resp.json()
-                processed = []
-                if isinstance(values, list):
-                    for v in values:
-                        if isinstance(v, dict) and metric in v.get("metricName", ""):
-                            data_point = {
-                                "lastUpdate": v.get("lastUpdate", 0),
-                                "value": max(0, round(v.get("metricValue", 0), 2))
-                            }
-                            sflow_data_store[metric].append(data_point)
-                            # Giới hạn số lượng bản ghi (20 điểm gần nhất)
-                            sflow_data_store[metric] = sflow_data_store[metric][-20:]
-                            processed.extend(sflow_data_store[metric])
-                else:
-                    logger.warning(f"Unexpected sFlow data format for {metric}: {values}")
-                results[metric] = {"name": label, "data": processed}
-            except requests.exceptions.RequestException as e:
+            except (requests.exceptions.RequestException, ValueError) as e:
                 logger.error(f"Failed to fetch sFlow metric {metric}: {e}")
-                results[metric] = {"name": label, "data": sflow_data_store[metric][-20:] if sflow_data_store[metric] else []}
-        return jsonify(results)
-    except Exception as e:
-        logger.error(f"Error fetching blackhole metrics: {e}")
-        return jsonify({})
-
-def read_csv(filepath, columns):
-    raw_data = defaultdict(list)
-    if os.path.exists(filepath):
-        with open(filepath, newline='') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                key = row.get("port_no", row.get("in_port", row.get("table_id", row.get("queue_id", row.get("meter_id", "0")))))
-                raw_data[key].append(row)
-
-    timeline = defaultdict(lambda: defaultdict(dict))
-    for key, rows in raw_data.items():
-        rows.sort(key=lambda x: float(x["timestamp"]))
-        for i in range(len(rows)):
-            t = float(rows[i]["timestamp"])
-            t_rounded = round(t / 10) * 10
-            for col in columns:
-                if col in ["port_no", "in_port", "out_port", "table_id", "queue_id", "meter_id"]:
-                    timeline[t_rounded][key][col] = rows[i][col]
-            delta_t = 10.0
-            if i == 0:
-                for col in columns:
-                    if col not in ["timestamp", "port_no", "in_port", "out_port", "table_id", "queue_id", "meter_id"]:
-                        timeline[t_rounded][key][col] = 0.0
+                continue
+            if not isinstance(values, list):
+                logger.warning(f"Unexpected sFlow data format for {metric}: {values}")
+                continue
+            store = sflow_data_store[metric]
+            for v in values:
+                if isinstance(v, dict) and metric in v.get("metricName", ""):
+                    try:
+                        value = max(0, round(float(v.get("metricValue", 0)), 2))
+                    except (TypeError, ValueError):
+                        logger.warning(f"Skipping non-numeric sFlow value for {metric}: {v}")
+                        continue
+                    # lastUpdate của sFlow-RT là tuổi của giá trị (ms); mốc thời gian lấy theo server
+                    store.append({"lastUpdate": v.get("lastUpdate", 0), "value": value, "timestamp": now})
+            # Giới hạn số lượng bản ghi
+            sflow_data_store[metric] = store[-SFLOW_HISTORY:]
+        sflow_store_seq += 1
+    finally:
+        sflow_poll_lock.release()
+
+def build_sflow_metrics(window=None):
+    results = {}
+    for metric, label in SFLOW_METRICS.items():
+        store = sflow_data_store[metric]
+        keep = select_buckets([d["timestamp"] for d in store], [d["value"] for d in store], window)
+        results[metric] = {"name": label, "data": [store[i] for i in keep]}
+    return results
+
+def file_version(paths):
+    """Phiên bản dữ liệu dựa trên kích thước và mtime của các file nguồn."""
+    parts = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            parts.append(f"{path}:{st.st_size}:{st.st_mtime_ns}")
+        except OSError:
+            parts.append(f"{path}:-")
+    return "|".join(parts)
+
+def versioned_response(version, build):
+    """Trả về JSON kèm ETag; trả 304 mà không gọi build() nếu client đã có bản mới nhất.
+
+    Hỗ trợ ?format=columnar (mỗi trường là một mảng) và nén gzip khi client chấp nhận.
+    """
+    use_gzip = "gzip" in request.headers.get("Accept-Encoding", "")
+    query = "&".join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+    digest = hashlib.sha1(f"{request.path}?{query}|{version}".encode()).hexdigest()[:20]
+    etag = f"{digest}-gz" if use_gzip else digest
+
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        with response_cache_lock:
+            body = response_cache.get(etag)
+        if body is None:
+            payload = build()
+            if request.args.get("format") == "columnar":
+                payload = to_columnar(payload)
+            body = json.dumps(payload, separators=(",", ":")).encode()
+            if use_gzip and len(body) >= GZIP_MIN_BYTES:
+                body = gzip.compress(body, compresslevel=6)
             else:
-                delta_t = float(rows[i]["timestamp"]) - float(rows[i-1]["timestamp"])
-                for col in columns:
-                    if col not in ["timestamp", "port_no", "in_port", "out_port", "table_id", "queue_id", "meter_id"]:
-                        try:
-                            delta_value = float(rows[i][col]) - float(rows[i-1][col])
-                            delta_value = max(0, delta_value)
-                            timeline[t_rounded][key][col] = delta_value
-                        except:
-                            timeline[t_rounded][key][col] = 0.0
-            timeline[t_rounded][key]["delta_t"] = delta_t
-
-    data = []
-    for t in sorted(timeline.keys())[-20:]:
-        for key, values in timeline[t].items():
-            d = {"timestamp": t}
-            d.update(values)
-            if "tx_bytes" in values:
-                d["tx_mbps"] = round(float(values["tx_bytes"]) * 8 / 1_000_000, 2)
-            if "rx_bytes" in values:
-                d["rx_mbps"] = round(float(values["rx_bytes"]) * 8 / 1_000_000, 2)
-            if "byte_count" in values:
-                d["mbps"] = round(float(values["byte_count"]) * 8 / 1_000_000, 2)
-            if "byte_in_count" in values:
-                d["in_mbps"] = round(float(values["byte_in_count"]) * 8 / 1_000_000, 2)
-            data.append(d)
-    return data
+                use_gzip = False
+            with response_cache_lock:
+                response_cache[etag] = body
+                while len(response_cache) > RESPONSE_CACHE_SIZE:
+                    response_cache.popitem(last=False)
+        elif use_gzip and body[:2] != b"\x1f\x8b":
+            # Payload nhỏ được lưu không nén
+            use_gzip = False
+        response = app.response_class(body, mimetype="application/json")
+        if use_gzip:
+            response.headers["Content-Encoding"] = "gzip"
+    response.set_etag(etag)
+    # Buộc trình duyệt luôn xác thực lại bằng If-None-Match
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+def to_columnar(payload):
+    """Chuyển danh sách dict thành dict các mảng theo từng trường."""
+    if isinstance(payload, list) and all(isinstance(entry, dict) for entry in payload):
+        columns = {}
+        for entry in payload:
+            for col in entry:
+                columns.setdefault(col, None)
+        return {col: [entry.get(col) for entry in payload] for col in columns}
+    if isinstance(payload, dict):
+        return {key: to_columnar(value) for key, value in payload.items()}
+    return payload
+
+def range_args():
+    """Đọc ?start=&end=&points= của request; trả về (start, end, points) hoặc None nếu không có."""
+    start = request.args.get("start", type=float)
+    end = request.args.get("end", type=float)
+    points = request.args.get("points", type=int)
+    if start is None and end is None and points is None:
+        return None
+    return start, end, points
+
+def select_buckets(timestamps, values, window=None):
+    """Chọn chỉ số các mốc cần trả về theo window = (start, end, points).
+
+    window là None thì giữ 20 mốc gần nhất như trước; ngược lại lọc theo khoảng
+    thời gian rồi lấy mẫu lại bằng LTTB còn tối đa `points` điểm.
+    """
+    ts = np.asarray(timestamps, dtype=float)
+    if window is None:
+        return np.arange(max(0, len(ts) - DEFAULT_BUCKETS), len(ts))
+    start, end, points = window
+    mask = np.ones(len(ts), dtype=bool)
+    if start is not None:
+        mask &= ts >= start
+    if end is not None:
+        mask &= ts <= end
+    idx = np.flatnonzero(mask)
+    n_out = min(max(points or DEFAULT_POINTS, 3), MAX_POINTS)
+    return idx[lttb_indices(ts[idx], np.asarray(values, dtype=float)[idx], n_out)]
+
+def lttb_indices(x, y, n_out):
+    """Largest-Triangle-Three-Buckets: giữ hình dạng chuỗi với n_out điểm."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[hi:next_hi].mean()
+        avg_y = y[hi:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+def load_table(filepath):
+    """Snapshot cột của một file stats: "columns" (mảng chuỗi) và "numeric" (float64, điền dần).
+
+    File chỉ được ghi nối thêm, nên lần đọc sau chỉ phân tích phần byte mới kể từ `offset`
+    (bỏ qua dòng cuối chưa ghi xong). Mỗi request dùng đúng một snapshot để các cột luôn cùng độ dài.
+    """
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return {"columns": {}, "numeric": {}}
+    version = (st.st_ino, st.st_size, st.st_mtime_ns)
+    with column_cache_lock:
+        cached = column_cache.get(filepath)
+        if cached is not None and cached["version"] == version:
+            return cached
+        if cached is not None and cached["version"][0] == st.st_ino and st.st_size >= cached["offset"]:
+            header, offset = cached["header"], cached["offset"]
+            columns, numeric = cached["columns"], dict(cached["numeric"])
+        else:
+            header, offset, columns, numeric = None, 0, {}, {}
+
+    with open(filepath, "rb") as f:
+        f.seek(offset)
+        data = f.read(st.st_size - offset)
+    end = data.rfind(b"\n") + 1
+    offset += end
+    reader = csv.reader(data[:end].decode().splitlines())
+    if header is None:
+        header = next(reader, None)
+        if header is None:
+            return {"columns": {}, "numeric": {}}
+        columns = {name: np.empty(0, dtype=str) for name in header}
+    # Bỏ dòng lỗi (thiếu cột)
+    rows = [row for row in reader if len(row) == len(header)]
+    if rows:
+        added = np.array(rows, dtype=str)
+        columns = {name: np.concatenate([columns[name], added[:, i]]) for i, name in enumerate(header)}
+        numeric = {name: np.concatenate([values, to_float(added[:, header.index(name)])])
+                   for name, values in numeric.items()}
+
+    table = {"version": version, "offset": offset, "header": header,
+             "columns": columns, "numeric": numeric}
+    with column_cache_lock:
+        column_cache[filepath] = table
+    return table
+
+def numeric_column(table, col):
+    """Cột `col` của snapshot dạng float64, chỉ chuyển đổi một lần."""
+    with column_cache_lock:
+        values = table["numeric"].get(col)
+    if values is None:
+        values = to_float(table["columns"][col])
+        with column_cache_lock:
+            table["numeric"][col] = values
+    return values
+
+def to_float(values):
+    try:
+        return values.astype(float)
+    except ValueError:
+        out = np.full(len(values), np.nan)
+        for i, v in enumerate(values):
+            try:
+                out[i] = float(v)
+            except ValueError:
+                pass
+        return out
+
+def counter_deltas(filepath, columns):
+    """Tính delta của các bộ đếm theo từng key, dạng mảng cột.
+
+    Mỗi key (port_no/in_port/table_id/...) được sắp theo thời gian; mẫu đầu tiên có delta 0 và
+    delta_t 10, delta âm bị kẹp về 0. Thời gian làm tròn về mốc 10 s, trong một mốc giữ mẫu cuối
+    của mỗi key. Kết quả sắp theo mốc, rồi theo thứ tự xuất hiện của key trong file.
+    """
+    table = load_table(filepath)
+    raw = table["columns"]
+    n = len(raw["timestamp"]) if "timestamp" in raw else 0
+    key_col = next((col for col in KEY_COLUMNS if col in raw), None)
+    keys = raw[key_col] if key_col else np.full(n, "0")
+    metrics = [col for col in columns if col != "timestamp" and col not in ID_COLUMNS]
+
+    ts = numeric_column(table, "timestamp") if n else np.empty(0)
+    key_ids, first_seen, key_codes = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.lexsort((ts, key_codes))
+    ts, key_codes = ts[order], key_codes[order]
+    first = np.ones(n, dtype=bool)
+    first[1:] = key_codes[1:] != key_codes[:-1]
+
+    delta_t = np.full(n, 10.0)
+    delta_t[1:] = np.where(first[1:], 10.0, np.diff(ts))
+    frame = {"delta_t": delta_t}
+    for col in metrics:
+        if col not in raw:
+            frame[col] = np.zeros(n)
+            continue
+        values = numeric_column(table, col)[order]
+        delta = np.zeros(n)
+        delta[1:] = np.diff(values)
+        delta = np.maximum(np.nan_to_num(delta, nan=0.0), 0.0)
+        delta[first] = 0.0
+        frame[col] = delta
+
+    buckets = np.round(ts / 10) * 10
+    last = np.ones(n, dtype=bool)
+    last[:-1] = (key_codes[1:] != key_codes[:-1]) | (buckets[1:] != buckets[:-1])
+    key_rank = np.argsort(np.argsort(first_seen))
+    final = np.lexsort((key_rank[key_codes[last]], buckets[last]))
+
+    result = {"timestamp": buckets[last][final].astype(np.int64)}
+    for col in columns:
+        if col in ID_COLUMNS and col in raw:
+            result[col] = raw[col][order][last][final]
+    for col in metrics:
+        result[col] = frame[col][last][final]
+    result["delta_t"] = frame["delta_t"][last][final]
+    return result
+
+def read_csv(filepath, columns, window=None, aggregate=False, cap_rows=False):
+    """Delta theo từng key, lọc/lấy mẫu theo window.
+
+    aggregate=True cộng mọi key thành một dòng mỗi mốc (cho biểu đồ theo thời gian), khi đó
+    `points` là số mốc. cap_rows=True dùng cho biểu đồ cột theo key: `points` giới hạn tổng số dòng.
+    """
+    frame = counter_deltas(filepath, columns)
+    timestamps = frame["timestamp"]
+    if len(timestamps):
+        # Mỗi mốc được đại diện bởi tổng các cột chỉ số trên mọi key
+        buckets, bucket_idx = np.unique(timestamps, return_inverse=True)
+        metrics = [col for col in frame if col not in ID_COLUMNS and col not in ("timestamp", "delta_t")]
+        row_totals = sum((frame[col] for col in metrics), np.zeros(len(timestamps)))
+        totals = np.bincount(bucket_idx, weights=row_totals, minlength=len(buckets))
+        if aggregate:
+            sums = {col: np.bincount(bucket_idx, weights=frame[col], minlength=len(buckets)) for col in metrics}
+            frame = {"timestamp": buckets, **sums}
+            timestamps = buckets
+        if window is not None and cap_rows:
+            # Mỗi mốc có một dòng cho mỗi key: `points` giới hạn tổng số dòng, không phải số mốc
+            start, end, points = window
+            rows_per_bucket = int(np.bincount(bucket_idx).max())
+            window = (start, end, max(3, min(points or DEFAULT_POINTS, MAX_POINTS) // rows_per_bucket))
+        selected = np.isin(timestamps, buckets[select_buckets(buckets, totals, window)])
+        frame = {col: values[selected] for col, values in frame.items()}
+
+    # Quy đổi Mbps trên cả mảng
+    for src, dst in [("tx_bytes", "tx_mbps"), ("rx_bytes", "rx_mbps"), ("byte_count", "mbps"), ("byte_in_count", "in_mbps")]:
+        if src in frame:
+            frame[dst] = np.round(frame[src] * 8 / 1_000_000, 2)
+
+    names = list(frame)
+    return [dict(zip(names, row)) for row in zip(*(frame[col].tolist() for col in names))]
 
 def get_switch_ids():
     ids = set()